@@ -1,30 +1,65 @@
 """
 Модуль для управления кэшем недействительных тегов.
 Этот модуль предоставляет функции для загрузки, сохранения и очистки кэша недействительных тегов.
+Кэш хранится в памяти процесса и записывается в файл при вызове flush_cache
+или при завершении программы.
 """
 
+import atexit
 import json
 import os
-from datetime import datetime, timedelta
+import time
+from datetime import datetime
 
 CACHE_FILE = "invalid_tags_cache.json"
 CACHE_EXPIRATION_DAYS = 14
+CACHE_EXPIRATION_SECONDS = CACHE_EXPIRATION_DAYS * 86400
+
+_cache: dict | None = None
+_dirty: bool = False
 
 def load_cache() -> dict:
-    """Загружает кэш недействительных тегов из файла, если он существует."""
-    if os.path.exists(CACHE_FILE):
-        with open(CACHE_FILE, "r") as file:
-            return json.load(file)
-    return {}
+    """Возвращает кэш недействительных тегов, загружая его из файла при первом обращении."""
+    global _cache
+    if _cache is None:
+        _cache = {}
+        if os.path.exists(CACHE_FILE):
+            with open(CACHE_FILE, "r") as file:
+                _cache = json.load(file)
+            _migrate_timestamps(_cache)
+    return _cache
+
+def _migrate_timestamps(invalid_tags: dict) -> None:
+    """Преобразует отметки времени в формате ISO из старых версий кэша в POSIX-время."""
+    global _dirty
+    for tag, added_at in invalid_tags.items():
+        if isinstance(added_at, str):
+            invalid_tags[tag] = datetime.fromisoformat(added_at).timestamp()
+            _dirty = True
 
 def save_cache(invalid_tags: dict) -> None:
-    """Сохраняет кэш недействительных тегов в файл."""
+    """Помечает кэш недействительных тегов как изменённый; запись в файл выполняет flush_cache."""
+    global _cache, _dirty
+    _cache = invalid_tags
+    _dirty = True
+
+def flush_cache() -> None:
+    """Записывает кэш недействительных тегов в файл, если он изменялся после последней записи."""
+    global _dirty
+    if not _dirty:
+        return
     with open(CACHE_FILE, "w") as file:
-        json.dump(invalid_tags, file)
-
-def clean_cache(invalid_tags: dict) -> None:
-    """Удаляет устаревшие теги из кэша."""
-    current_time = datetime.now()
-    for tag in list(invalid_tags.keys()):
-        if current_time - datetime.fromisoformat(invalid_tags[tag]) > timedelta(days=CACHE_EXPIRATION_DAYS):
-            del invalid_tags[tag]
+        json.dump(_cache, file, separators=(",", ":"))
+    _dirty = False
+
+atexit.register(flush_cache)
+
+def clean_cache(invalid_tags: dict) -> bool:
+    """Удаляет устаревшие теги из кэша и возвращает True, если что-то было удалено."""
+    if not invalid_tags:
+        return False
+    cutoff = time.time() - CACHE_EXPIRATION_SECONDS
+    expired_tags = [tag for tag, added_at in invalid_tags.items() if added_at < cutoff]
+    for tag in expired_tags:
+        del invalid_tags[tag]
+    return bool(expired_tags)
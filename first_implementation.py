@@ -5,11 +5,35 @@
 применение правил для тегов с учетом синонимов.
 """
 
-from typing import NamedTuple, Optional
+from typing import NamedTuple, Optional, Protocol
 import collections
-from datetime import datetime
+import functools
+import logging
+import re
+import sys
+from dataclasses import dataclass
+from types import MappingProxyType
+import time
 from delete_cache import load_cache, save_cache, clean_cache
 
+logger = logging.getLogger(__name__)
+
+try:
+    # pyahocorasick: автомат Ахо-Корасик на C, находит все разрешённые теги внутри
+    # составного тега за один проход; без библиотеки тег разбивается по CamelCase
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Минимальная доля составного тега, которую должны покрыть найденные разрешённые теги
+MIN_SPLIT_COVERAGE = 0.5
+
+# Таблица замены пробелов и дефисов на нижнее подчеркивание за один проход по строке
+_NORMALIZE_TABLE = str.maketrans({" ": "_", "-": "_"})
+
+# Разбиение CamelCase: заглавная буква с последующими строчными либо начальный фрагмент без заглавных
+_CAMEL_CASE_RE = re.compile(r"[A-ZА-ЯЁ][^A-ZА-ЯЁ]*|[^A-ZА-ЯЁ]+")
+
 class AllowedTagRecord(NamedTuple):
     """Запись в таблице правил."""
     allowed_name: str
@@ -17,9 +41,33 @@ class AllowedTagRecord(NamedTuple):
     immutable: bool = False
     separated: bool = False
 
+@functools.lru_cache(maxsize=4096)
 def normalize_tag(tag: str) -> str:
     """Приводит тег к стандартному формату с нижним регистром."""
-    return tag.replace(" ", "_").replace("-", "_").lower()
+    return tag.translate(_NORMALIZE_TABLE).lower()
+
+def _char_counts(token: str) -> collections.Counter:
+    """Возвращает мультимножество символов токена для расчёта коэффициента Тэнимото."""
+    return collections.Counter(token)
+
+def _tanimoto(
+    first_counts: collections.Counter,
+    first_length: int,
+    second_counts: collections.Counter,
+    second_length: int
+) -> float:
+    """Вычисляет коэффициент Тэнимото по заранее подсчитанным мультимножествам символов.
+
+    Число совпавших символов равно мощности пересечения мультимножеств, что
+    эквивалентно жадному посимвольному сопоставлению с пометкой использованных символов.
+    """
+    # Поэлементный минимум без построения промежуточного Counter, как в first_counts & second_counts
+    equal_subtokens_count = sum([
+        count if count < other_count else other_count
+        for char, count in first_counts.items()
+        if (other_count := second_counts.get(char))
+    ])
+    return equal_subtokens_count / (first_length + second_length - equal_subtokens_count)
 
 def is_tokens_fuzzy_equal(first_token: str, second_token: str) -> float:
     """Определяет коэффициент схожести Тэнимото между двумя строками.
@@ -31,139 +79,270 @@ def is_tokens_fuzzy_equal(first_token: str, second_token: str) -> float:
     Возвращает:
         float: Коэффициент схожести между токенами.
     """
-    equal_subtokens_count = 0
-    subtoken_length = 1
-    used_tokens = [False] * (len(second_token) - subtoken_length + 1)
-    for i in range(len(first_token) - subtoken_length + 1):
-        subtoken_first = first_token[i:i + subtoken_length]
-        for j in range(len(second_token) - subtoken_length + 1):
-            if not used_tokens[j]:
-                subtoken_second = second_token[j:j + subtoken_length]
-                if subtoken_first == subtoken_second:
-                    equal_subtokens_count += 1
-                    used_tokens[j] = True
-                    break
-
-    subtoken_first_count = len(first_token) - subtoken_length + 1
-    subtoken_second_count = len(second_token) - subtoken_length + 1
-
-    tanimoto = equal_subtokens_count / (subtoken_first_count + subtoken_second_count - equal_subtokens_count)
-    return tanimoto
-
-def find_best_match(tag: str, allowed_tags_with_synonyms: dict) -> Optional[str]:
+    return _tanimoto(
+        _char_counts(first_token), len(first_token),
+        _char_counts(second_token), len(second_token)
+    )
+
+def find_best_match(
+    tag: str,
+    allowed_tags_with_synonyms: dict,
+    allowed_by_length: dict
+) -> Optional[str]:
     """Находит лучшее совпадение для заданного тега на основе коэффициента Тэнимото.
 
     Аргументы:
         tag (str): Тег, для которого ищем лучшее совпадение.
         allowed_tags_with_synonyms (dict): Словарь допустимых тегов с синонимами.
+        allowed_by_length (dict): Ключи allowed_tags_with_synonyms, сгруппированные по длине,
+            в виде кортежей (позиция в словаре, тег, мультимножество символов).
     
     Возвращает:
         Optional[str]: Лучше совпадающий тег или None, если совпадение не найдено.
     """
     normalized_tag = normalize_tag(tag)
+    tag_counts = _char_counts(normalized_tag)
+    tag_length = len(normalized_tag)
     best_match = None
+    best_position = None
     best_score = 0.6  # Минимальный порог для совпадения
-    print(f"Поиск лучшего совпадения для '{tag}' (нормализованный: '{normalized_tag}'):")
-    for allowed_tag in allowed_tags_with_synonyms.keys():
-        score = is_tokens_fuzzy_equal(normalized_tag, allowed_tag)
-        print(f"  Проверка '{allowed_tag}': коэффициент схожести = {score:.2f}")
-        if score > best_score:
-            best_score = score
-            best_match = allowed_tag
+    # Коэффициент не превышает отношения меньшей длины к большей, поэтому теги
+    # с сильно отличающейся длиной не могут пройти порог и не проверяются
+    min_length = int(tag_length * best_score)
+    max_length = int(tag_length / best_score) + 1
+    logger.debug("Поиск лучшего совпадения для '%s' (нормализованный: '%s'):", tag, normalized_tag)
+    for length in range(min_length, max_length + 1):
+        for position, allowed_tag, allowed_counts in allowed_by_length.get(length, ()):
+            score = _tanimoto(tag_counts, tag_length, allowed_counts, length)
+            logger.debug("  Проверка '%s': коэффициент схожести = %.2f", allowed_tag, score)
+            # При равенстве коэффициентов выигрывает тег, стоящий раньше в словаре
+            if score > best_score or (score == best_score and best_match and position < best_position):
+                best_score = score
+                best_match = allowed_tag
+                best_position = position
 
     if best_match:
-        print(f"  Найдено лучшее совпадение: '{best_match}' с коэффициентом {best_score:.2f}")
+        logger.debug("  Найдено лучшее совпадение: '%s' с коэффициентом %.2f", best_match, best_score)
     else:
-        print("  Нет подходящего совпадения.")
+        logger.debug("  Нет подходящего совпадения.")
 
     return allowed_tags_with_synonyms.get(best_match) if best_match else None
 
-def split_composite_tag(tag: str, allowed_tags: dict) -> list:
+def split_composite_tag(tag: str, allowed_tags: dict, automaton: Optional[object] = None) -> list:
     """Разделяет составные теги на отдельные части, если это возможно.
 
     Аргументы:
         tag (str): Составной тег для разделения.
         allowed_tags (dict): Словарь допустимых тегов.
+        automaton (Optional[object]): Автомат Ахо-Корасик по ключам allowed_tags;
+            если не задан или найденные им части покрывают слишком малую долю тега,
+            тег разбивается по заглавным буквам.
     
     Возвращает:
         list: Список нормализованных тегов или пустой список, если разбиение невозможно.
     """
-    parts = []
-    current_part = ""
-    for char in tag:
-        if char.isupper() and current_part:
-            parts.append(current_part)
-            current_part = char
-        else:
-            current_part += char
-    if current_part:
-        parts.append(current_part)
+    if automaton is not None:
+        normalized_tag = normalize_tag(tag)
+        split_tags = []
+        covered_length = 0
+        # Самые длинные непересекающиеся вхождения разрешённых тегов слева направо
+        for _, (length, allowed_name) in automaton.iter_long(normalized_tag):
+            split_tags.append(allowed_name)
+            covered_length += length
+        # Найденные части должны покрывать существенную долю тега, иначе это случайные вхождения
+        if covered_length >= len(normalized_tag) * MIN_SPLIT_COVERAGE:
+            return split_tags
+    # Разбиение по CamelCase находит и части, которые автомат не видит после нормализации
+    # (например, LockScreen -> lockscreen не совпадает с lock_screen)
+    # Каждая часть начинается с заглавной буквы, кроме, возможно, первой
+    parts = _CAMEL_CASE_RE.findall(tag)
     # Проверяем части на соответствие разрешённым тегам
-    return [allowed_tags[normalize_tag(part)] for part in parts if normalize_tag(part) in allowed_tags]
+    return [
+        allowed_tags[normalized_part]
+        for part in parts
+        if (normalized_part := normalize_tag(part)) in allowed_tags
+    ]
+
+@dataclass(frozen=True, eq=False)
+class CompiledRules:
+    """Предварительно обработанная таблица правил, переиспользуемая между вызовами."""
+    allowed_tags_with_synonyms: MappingProxyType
+    allowed_by_length: dict
+    automaton: Optional[object] = None
+
+@functools.lru_cache(maxsize=32)
+def compile_rules(rules: tuple[AllowedTagRecord, ...]) -> CompiledRules:
+    """Строит словари для поиска тегов по таблице правил.
+
+    Результат кэшируется по кортежу правил, поэтому повторные вызовы
+    apply_tag_rules с теми же правилами не пересобирают словари.
+
+    Аргументы:
+        rules (tuple[AllowedTagRecord, ...]): Кортеж правил.
+
+    Возвращает:
+        CompiledRules: Подготовленные к поиску правила.
+    """
+    # Создаем словарь с нормализованными тегами и синонимами
+    # Ключи интернируются, чтобы проверка наличия тега сравнивала строки по ссылке
+    allowed_tags_with_synonyms = {
+        sys.intern(normalize_tag(record.allowed_name)): record.allowed_name for record in rules
+    }
+    for record in rules:
+        if record.synonyms:
+            for synonym in record.synonyms.split(', '):
+                allowed_tags_with_synonyms[sys.intern(normalize_tag(synonym.strip()))] = record.allowed_name
+    # Группируем теги по длине; мультимножества символов считаются один раз, а не на каждую пару
+    allowed_by_length = {}
+    for position, allowed_tag in enumerate(allowed_tags_with_synonyms):
+        allowed_by_length.setdefault(len(allowed_tag), []).append(
+            (position, allowed_tag, _char_counts(allowed_tag))
+        )
+    automaton = None
+    if ahocorasick is not None and allowed_tags_with_synonyms:
+        automaton = ahocorasick.Automaton()
+        for allowed_tag, allowed_name in allowed_tags_with_synonyms.items():
+            automaton.add_word(allowed_tag, (len(allowed_tag), allowed_name))
+        automaton.make_automaton()
+    # Результат кэшируется и разделяется между вызовами, поэтому словарь отдаётся только для чтения
+    return CompiledRules(MappingProxyType(allowed_tags_with_synonyms), allowed_by_length, automaton)
+
+@functools.lru_cache(maxsize=8192)
+def _resolve_tag(tag: str, compiled: CompiledRules) -> tuple[str, ...]:
+    """Сопоставляет один тег с таблицей правил.
+
+    Результат запоминается для пары (тег, правила), поэтому часто повторяющиеся
+    теги не проходят повторно через разбиение и поиск лучшего совпадения.
+
+    Аргументы:
+        tag (str): Тег для обработки.
+        compiled (CompiledRules): Подготовленные правила.
+
+    Возвращает:
+        tuple[str, ...]: Найденные разрешённые теги или пустой кортеж, если совпадение не найдено.
+    """
+    allowed_tags_with_synonyms = compiled.allowed_tags_with_synonyms
+
+    # Проверка, если тег существует как полный
+    exact_match = allowed_tags_with_synonyms.get(sys.intern(normalize_tag(tag)))
+    if exact_match is not None:
+        logger.debug("Тег найден: '%s'", exact_match)
+        return (exact_match,)
+
+    # Разделение на части и проверка каждой
+    split_tags = split_composite_tag(tag, allowed_tags_with_synonyms, compiled.automaton)
+    if split_tags:
+        logger.debug("Найдены составные теги: %s", split_tags)
+        return tuple(split_tags)
+
+    # Ищем лучшее совпадение
+    best_match = find_best_match(tag, allowed_tags_with_synonyms, compiled.allowed_by_length)
+    return (best_match,) if best_match else ()
 
 def apply_tag_rules(
     tags: str,
-    rules: tuple[AllowedTagRecord, ...],
+    rules: tuple[AllowedTagRecord, ...] | CompiledRules,
     delayed_clean: bool = False
 ) -> str:
     """Применяет правила для обработки тегов и возвращает нормализованные теги."""   
-    print(f"\nИсходные теги: {tags}")
+    logger.debug("Исходные теги: %s", tags)
 
     # Загружаем кэш недействительных тегов
     invalid_tags_cache = load_cache()
-    clean_cache(invalid_tags_cache)
-    # Создаем словарь с нормализованными тегами и синонимами
-    allowed_tags = {normalize_tag(record.allowed_name): record.allowed_name for record in rules}
-    allowed_tags_with_synonyms = allowed_tags.copy()
-    for record in rules:
-        if record.synonyms:
-            for synonym in record.synonyms.split(', '):
-                allowed_tags_with_synonyms[normalize_tag(synonym)] = record.allowed_name
+    cache_changed = clean_cache(invalid_tags_cache)
+    compiled = rules if isinstance(rules, CompiledRules) else compile_rules(rules)
 
     result_tags = []
 
     for tag in tags.split(";"):
         tag = tag.strip()
-        print(f"Обработка тега '{tag}'...")
+        logger.debug("Обработка тега '%s'...", tag)
 
-        # Проверка, если тег существует как полный
-        normalized_tag = normalize_tag(tag)
-        if normalized_tag in allowed_tags_with_synonyms:
-            result_tags.append(allowed_tags_with_synonyms[normalized_tag])
-            print(f"Тег найден: '{allowed_tags_with_synonyms[normalized_tag]}'")
+        resolved_tags = _resolve_tag(tag, compiled)
+        if resolved_tags:
+            result_tags.extend(resolved_tags)
+        elif delayed_clean:
+            invalid_tags_cache[tag] = time.time()  # Запоминаем текущее время
+            cache_changed = True
+            logger.debug("Тег '%s' добавлен в кэш: не найдено подходящее совпадение.", tag)
         else:
-            # Разделение на части и проверка каждой
-            split_tags = split_composite_tag(tag, allowed_tags_with_synonyms)
-            if split_tags:
-                result_tags.extend(split_tags)
-                print(f"Найдены составные теги: {split_tags}")
-            else:
-                # Ищем лучшее совпадение
-                best_match = find_best_match(tag, allowed_tags_with_synonyms)
-                if best_match:
-                    result_tags.append(best_match)
-                elif delayed_clean:
-                    invalid_tags_cache[tag] = datetime.now().isoformat()  # Запоминаем текущее время
-                    print(f"Тег '{tag}' добавлен в кэш: не найдено подходящее совпадение.")
-                else:
-                    print(f"Тег '{tag}' удалён: не найдено подходящее совпадение.")
-    if delayed_clean:
-        for invalid_tag in list(invalid_tags_cache.keys()):
-            if invalid_tag not in result_tags:
-                continue
-            else:
-                print(f"Тег '{invalid_tag}' устарел и удалён из результата.")
-                del invalid_tags_cache[invalid_tag]
-
-    save_cache(invalid_tags_cache)
-    final_tags = list(collections.OrderedDict.fromkeys(result_tags))
+            logger.debug("Тег '%s' удалён: не найдено подходящее совпадение.", tag)
+    if delayed_clean and invalid_tags_cache:
+        # Пересечение ключей кэша с результатом строится один раз, без копии всех ключей
+        for invalid_tag in invalid_tags_cache.keys() & set(result_tags):
+            logger.debug("Тег '%s' устарел и удалён из результата.", invalid_tag)
+            del invalid_tags_cache[invalid_tag]
+            cache_changed = True
+
+    if cache_changed:
+        save_cache(invalid_tags_cache)
+    final_tags = list(dict.fromkeys(result_tags))
 
     # Формируем итоговую строку тегов
     final_tags_str = "; ".join(final_tags)
-    print(f"Итоговые теги: {final_tags_str}")
+    logger.debug("Итоговые теги: %s", final_tags_str)
     return final_tags_str
 
+# Исходный код специализированной функции; таблица тегов подставляется в виде литерала
+_NORMALIZER_TEMPLATE = """
+_LOOKUP = {lookup}
+
+def normalize_tags(tags: str, delayed_clean: bool = False) -> str:
+    if not delayed_clean:
+        result_tags = []
+        for tag in tags.split(";"):
+            allowed_name = _LOOKUP.get(normalize_tag(tag.strip()))
+            if allowed_name is None:
+                break
+            result_tags.append(allowed_name)
+        else:
+            # Кэш обслуживается так же, как в apply_tag_rules: устаревшие записи удаляются
+            invalid_tags_cache = load_cache()
+            if clean_cache(invalid_tags_cache):
+                save_cache(invalid_tags_cache)
+            return "; ".join(dict.fromkeys(result_tags))
+    return apply_tag_rules(tags, _COMPILED, delayed_clean)
+"""
+
+class TagNormalizer(Protocol):
+    """Функция обработки тегов, созданная make_tag_normalizer."""
+
+    def __call__(self, tags: str, delayed_clean: bool = False) -> str:
+        ...
+
+def make_tag_normalizer(rules: tuple[AllowedTagRecord, ...]) -> TagNormalizer:
+    """Создаёт функцию обработки тегов, специализированную под конкретную таблицу правил.
+
+    Таблица нормализованных тегов и синонимов встраивается в сгенерированный код
+    в виде литерала. Если все теги строки находятся точным поиском и отложенное
+    удаление выключено, результат формируется без разбиения и поиска лучшего
+    совпадения; иначе вызывается apply_tag_rules с заранее подготовленными
+    правилами. В обоих случаях кэш недействительных тегов очищается от
+    устаревших записей, как в apply_tag_rules.
+
+    Аргументы:
+        rules (tuple[AllowedTagRecord, ...]): Кортеж правил.
+
+    Возвращает:
+        TagNormalizer: Функция с параметрами tags и необязательным delayed_clean
+            (по умолчанию False), возвращающая тот же результат и оказывающая то же
+            действие на кэш, что и apply_tag_rules для заданных правил.
+    """
+    compiled = compile_rules(rules)
+    source = _NORMALIZER_TEMPLATE.format(lookup=repr(dict(compiled.allowed_tags_with_synonyms)))
+    namespace = {
+        "normalize_tag": normalize_tag,
+        "apply_tag_rules": apply_tag_rules,
+        "load_cache": load_cache,
+        "clean_cache": clean_cache,
+        "save_cache": save_cache,
+        "_COMPILED": compiled,
+    }
+    exec(compile(source, "<tag_normalizer>", "exec"), namespace)
+    return namespace["normalize_tags"]
+
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG, format="%(message)s")
     rules = (
         AllowedTagRecord("SRS", immutable=True),
         AllowedTagRecord("web_engine"),
@@ -175,6 +354,7 @@ if __name__ == "__main__":
         AllowedTagRecord("AUTO", immutable=True),
         AllowedTagRecord("lock_screen", "экран блокировки"),
     )
+    normalizer = make_tag_normalizer(rules)
 
     for input_tags, expected_tags in (
         ("WebEngine; AUTO", "web_engine; AUTO"),
@@ -185,6 +365,24 @@ if __name__ == "__main__":
         ("", ""),
         ("unknown-tag; lcd", "display"),
         ("auto", "AUTO"),
+        # составной тег: разрешённые части выделяются по заглавным буквам
+        ("ContactsLockScreen", "contacts"),
+        ("MessagesWebEngine", "sms"),
     ):
         RESULT = apply_tag_rules(input_tags, rules, delayed_clean=True)
         assert RESULT == expected_tags, f"Failed on {input_tags}: expected '{expected_tags}', got '{RESULT}'"
+        RESULT = normalizer(input_tags)
+        assert RESULT == expected_tags, f"Failed on {input_tags}: expected '{expected_tags}', got '{RESULT}'"
+
+    if ahocorasick is not None:
+        for input_tags, expected_tags in (
+            # составной тег без заглавных букв разделяется автоматом
+            ("lcdsvc", "display; svc"),
+            ("дисплейsvc", "display; svc"),
+            # разрешённый тег покрывает половину тега
+            ("x86_64", "x86"),
+            # случайное вхождение sms покрывает меньше половины тега, тег удаляется
+            ("gsmsignal", ""),
+        ):
+            RESULT = apply_tag_rules(input_tags, rules)
+            assert RESULT == expected_tags, f"Failed on {input_tags}: expected '{expected_tags}', got '{RESULT}'"
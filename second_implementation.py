@@ -5,12 +5,42 @@
 применение правил для тегов с учетом синонимов.
 """
 
-import collections
 import difflib
-from typing import NamedTuple, Optional
-from datetime import datetime
+import functools
+import logging
+import re
+import sys
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import NamedTuple, Optional, Protocol
+import time
 from delete_cache import load_cache, save_cache, clean_cache
 
+logger = logging.getLogger(__name__)
+
+try:
+    # rapidfuzz: расстояние Левенштейна на C++, на порядок быстрее difflib;
+    # при отсутствии библиотеки используется difflib из стандартной библиотеки
+    from rapidfuzz import fuzz, process
+except ImportError:
+    process = None
+
+try:
+    # pyahocorasick: автомат Ахо-Корасик на C, находит все разрешённые теги внутри
+    # составного тега за один проход; без библиотеки тег разбивается по CamelCase
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Минимальная доля составного тега, которую должны покрыть найденные разрешённые теги
+MIN_SPLIT_COVERAGE = 0.5
+
+# Таблица замены пробелов и дефисов на нижнее подчеркивание за один проход по строке
+_NORMALIZE_TABLE = str.maketrans({" ": "_", "-": "_"})
+
+# Разбиение CamelCase: заглавная буква с последующими строчными либо начальный фрагмент без заглавных
+_CAMEL_CASE_RE = re.compile(r"[A-ZА-ЯЁ][^A-ZА-ЯЁ]*|[^A-ZА-ЯЁ]+")
+
 
 class AllowedTagRecord(NamedTuple):
     """Запись в таблице правил для допустимых тегов."""
@@ -19,107 +49,272 @@ class AllowedTagRecord(NamedTuple):
     immutable: bool = False
     separated: bool = False
 
+@functools.lru_cache(maxsize=4096)
 def normalize_tag(tag: str) -> str:
     """Приводит тег к стандартному формату с нижним регистром и заменяет пробелы и дефисы на нижнее подчеркивание."""
-    return tag.replace(" ", "_").replace("-", "_").lower()
+    return tag.translate(_NORMALIZE_TABLE).lower()
 
-def find_best_match(tag: str, allowed_tags_with_synonyms: dict) -> Optional[str]:
+def find_best_match(
+    tag: str,
+    allowed_tags_with_synonyms: dict,
+    allowed_by_length: dict
+) -> Optional[str]:
     """Находит лучшее совпадение для заданного тега на основе расстояния Левенштейна.
     
     Аргументы:
         tag (str): Тег, для которого нужно найти совпадение.
         allowed_tags_with_synonyms (dict): Словарь разрешенных тегов и синонимов.
+        allowed_by_length (dict): Ключи allowed_tags_with_synonyms, сгруппированные по длине.
     
     Возвращает:
         Optional[str]: Лучшее совпадение для заданного тега, если оно найдено; иначе None.
     """
     normalized_tag = normalize_tag(tag)
-    matches = difflib.get_close_matches(normalized_tag, allowed_tags_with_synonyms.keys(), n=1, cutoff=0.6)
-    return allowed_tags_with_synonyms.get(matches[0]) if matches else None
+    # Схожесть 2 * M / (L1 + L2) не превышает 2 * min / (L1 + L2), поэтому при пороге 0.6
+    # достаточно проверить теги длиной от 3/7 до 7/3 длины искомого
+    tag_length = len(normalized_tag)
+    choices = [
+        allowed_tag
+        for length in range((3 * tag_length + 6) // 7, 7 * tag_length // 3 + 1)
+        for allowed_tag in allowed_by_length.get(length, ())
+    ]
+    if process is not None:
+        # extractOne возвращает первый из равных по схожести вариантов; обратная сортировка
+        # даёт больший тег, как в ветке difflib ниже
+        match = process.extractOne(
+            normalized_tag, sorted(choices, reverse=True), scorer=fuzz.ratio, score_cutoff=60
+        )
+        return allowed_tags_with_synonyms[match[0]] if match else None
+    best_match = None
+    best_ratio = 0.6  # Минимальный порог для совпадения
+    # Как в difflib.get_close_matches: индекс строится один раз по искомому тегу (seq2),
+    # кандидаты подставляются в seq1; сопоставитель локален для вызова
+    matcher = difflib.SequenceMatcher()
+    matcher.set_seq2(normalized_tag)
+    for allowed_tag in choices:
+        matcher.set_seq1(allowed_tag)
+        # Быстрые верхние оценки отсекают кандидатов до полного сравнения, как в get_close_matches
+        if matcher.real_quick_ratio() < best_ratio or matcher.quick_ratio() < best_ratio:
+            continue
+        ratio = matcher.ratio()
+        # При равенстве выбирается больший тег, как в difflib.get_close_matches
+        if ratio > best_ratio or (ratio == best_ratio and (best_match is None or allowed_tag > best_match)):
+            best_ratio = ratio
+            best_match = allowed_tag
+    return allowed_tags_with_synonyms.get(best_match) if best_match else None
 
-def split_composite_tag(tag: str, allowed_tags: dict) -> list:
+def split_composite_tag(tag: str, allowed_tags: dict, automaton: Optional[object] = None) -> list:
     """Разделяет составные теги на отдельные части, если это возможно.
     
     Аргументы:
         tag (str): Тег для разделения.
         allowed_tags (dict): Словарь разрешенных тегов.
+        automaton (Optional[object]): Автомат Ахо-Корасик по ключам allowed_tags;
+            если не задан или найденные им части покрывают слишком малую долю тега,
+            тег разбивается по заглавным буквам.
     
     Возвращает:
         list: Список разрешенных тегов, если они найдены.
     """
-    parts = []
-    current_part = ""
-    for char in tag:
-        if char.isupper() and current_part:
-            parts.append(current_part)
-            current_part = char
-        else:
-            current_part += char
-    if current_part:
-        parts.append(current_part)
-    return [allowed_tags[normalize_tag(part)] for part in parts if normalize_tag(part) in allowed_tags]
+    if automaton is not None:
+        normalized_tag = normalize_tag(tag)
+        split_tags = []
+        covered_length = 0
+        # Самые длинные непересекающиеся вхождения разрешённых тегов слева направо
+        for _, (length, allowed_name) in automaton.iter_long(normalized_tag):
+            split_tags.append(allowed_name)
+            covered_length += length
+        # Найденные части должны покрывать существенную долю тега, иначе это случайные вхождения
+        if covered_length >= len(normalized_tag) * MIN_SPLIT_COVERAGE:
+            return split_tags
+    # Разбиение по CamelCase находит и части, которые автомат не видит после нормализации
+    # (например, LockScreen -> lockscreen не совпадает с lock_screen)
+    # Каждая часть начинается с заглавной буквы, кроме, возможно, первой
+    parts = _CAMEL_CASE_RE.findall(tag)
+    # Проверяем части на соответствие разрешённым тегам
+    return [
+        allowed_tags[normalized_part]
+        for part in parts
+        if (normalized_part := normalize_tag(part)) in allowed_tags
+    ]
+
+@dataclass(frozen=True, eq=False)
+class CompiledRules:
+    """Предварительно обработанная таблица правил, переиспользуемая между вызовами."""
+    allowed_tags_with_synonyms: MappingProxyType
+    allowed_by_length: dict
+    automaton: Optional[object] = None
+
+@functools.lru_cache(maxsize=32)
+def compile_rules(rules: tuple[AllowedTagRecord, ...]) -> CompiledRules:
+    """Строит словари для поиска тегов по таблице правил.
+
+    Результат кэшируется по кортежу правил, поэтому повторные вызовы
+    apply_tag_rules с теми же правилами не пересобирают словари.
+
+    Аргументы:
+        rules (tuple[AllowedTagRecord, ...]): Кортеж правил.
+
+    Возвращает:
+        CompiledRules: Подготовленные к поиску правила.
+    """
+    # Создаем словарь с нормализованными тегами и синонимами
+    # Ключи интернируются, чтобы проверка наличия тега сравнивала строки по ссылке
+    allowed_tags_with_synonyms = {
+        sys.intern(normalize_tag(record.allowed_name)): record.allowed_name for record in rules
+    }
+
+    for record in rules:
+        if record.synonyms:
+            for synonym in record.synonyms.split(', '):
+                allowed_tags_with_synonyms[sys.intern(normalize_tag(synonym.strip()))] = record.allowed_name
+    allowed_by_length = {}
+    for allowed_tag in allowed_tags_with_synonyms:
+        allowed_by_length.setdefault(len(allowed_tag), []).append(allowed_tag)
+    automaton = None
+    if ahocorasick is not None and allowed_tags_with_synonyms:
+        automaton = ahocorasick.Automaton()
+        for allowed_tag, allowed_name in allowed_tags_with_synonyms.items():
+            automaton.add_word(allowed_tag, (len(allowed_tag), allowed_name))
+        automaton.make_automaton()
+    # Результат кэшируется и разделяется между вызовами, поэтому словарь отдаётся только для чтения
+    return CompiledRules(MappingProxyType(allowed_tags_with_synonyms), allowed_by_length, automaton)
+
+@functools.lru_cache(maxsize=8192)
+def _resolve_tag(tag: str, compiled: CompiledRules) -> tuple[str, ...]:
+    """Сопоставляет один тег с таблицей правил.
+
+    Результат запоминается для пары (тег, правила), поэтому часто повторяющиеся
+    теги не проходят повторно через разбиение и поиск лучшего совпадения.
+
+    Аргументы:
+        tag (str): Тег для обработки.
+        compiled (CompiledRules): Подготовленные правила.
+
+    Возвращает:
+        tuple[str, ...]: Найденные разрешённые теги или пустой кортеж, если совпадение не найдено.
+    """
+    allowed_tags_with_synonyms = compiled.allowed_tags_with_synonyms
+
+    # Проверка, если тег существует как полный
+    exact_match = allowed_tags_with_synonyms.get(sys.intern(normalize_tag(tag)))
+    if exact_match is not None:
+        return (exact_match,)
+
+    split_tags = split_composite_tag(tag, allowed_tags_with_synonyms, compiled.automaton)
+    if split_tags:
+        return tuple(split_tags)
+
+    best_match = find_best_match(
+        tag, allowed_tags_with_synonyms, compiled.allowed_by_length
+    )
+    return (best_match,) if best_match else ()
 
 def apply_tag_rules(
     tags: str,
-    rules: tuple[AllowedTagRecord, ...],
+    rules: tuple[AllowedTagRecord, ...] | CompiledRules,
     delayed_clean: bool = False,
 ) -> str:
     """Применяет правила для обработки тегов и возвращает нормализованные теги."""
-    print(f"\nИсходные теги: {tags}")
+    logger.debug("Исходные теги: %s", tags)
 
     # Загружаем кэш недействительных тегов
     invalid_tags_cache = load_cache()
-    clean_cache(invalid_tags_cache)
+    cache_changed = clean_cache(invalid_tags_cache)
 
-    # Создаем словарь с нормализованными тегами и синонимами
-    allowed_tags = {normalize_tag(record.allowed_name): record.allowed_name for record in rules}
-    allowed_tags_with_synonyms = allowed_tags.copy()
-
-    for record in rules:
-        if record.synonyms:
-            for synonym in record.synonyms.split(', '):
-                allowed_tags_with_synonyms[normalize_tag(synonym)] = record.allowed_name
+    compiled = rules if isinstance(rules, CompiledRules) else compile_rules(rules)
 
     result_tags = []
 
     for tag in tags.split(";"):
         tag = tag.strip()
-        print(f"Обработка тега '{tag}'")
-        # Проверка, если тег существует как полный
-        normalized_tag = normalize_tag(tag)
-        if normalized_tag in allowed_tags_with_synonyms:
-            result_tags.append(allowed_tags_with_synonyms[normalized_tag])
+        logger.debug("Обработка тега '%s'", tag)
+        resolved_tags = _resolve_tag(tag, compiled)
+        if resolved_tags:
+            result_tags.extend(resolved_tags)
+        elif delayed_clean:
+            invalid_tags_cache[tag] = time.time()  # Запоминаем текущее время
+            cache_changed = True
+            logger.debug("Тег '%s' добавлен в кэш: не найдено подходящее совпадение.", tag)
         else:
-            split_tags = split_composite_tag(tag, allowed_tags_with_synonyms)
-            if split_tags:
-                result_tags.extend(split_tags)
-            else:
-                best_match = find_best_match(tag, allowed_tags_with_synonyms)
-                if best_match:
-                    result_tags.append(best_match)
-                elif delayed_clean:
-                    invalid_tags_cache[tag] = datetime.now().isoformat()  # Запоминаем текущее время
-                    print(f"Тег '{tag}' добавлен в кэш: не найдено подходящее совпадение.")
-                else:
-                    print(f"Тег '{tag}' удалён: не найдено подходящее совпадение.")
-
-    if delayed_clean:
-        for invalid_tag in list(invalid_tags_cache.keys()):
-            if invalid_tag not in result_tags:
-                continue
-            else:
-                print(f"Тег '{invalid_tag}' устарел и удалён из результата.")
-                del invalid_tags_cache[invalid_tag]
-
-    save_cache(invalid_tags_cache)
-    final_tags = list(collections.OrderedDict.fromkeys(result_tags))
+            logger.debug("Тег '%s' удалён: не найдено подходящее совпадение.", tag)
+
+    if delayed_clean and invalid_tags_cache:
+        # Пересечение ключей кэша с результатом строится один раз, без копии всех ключей
+        for invalid_tag in invalid_tags_cache.keys() & set(result_tags):
+            logger.debug("Тег '%s' устарел и удалён из результата.", invalid_tag)
+            del invalid_tags_cache[invalid_tag]
+            cache_changed = True
+
+    if cache_changed:
+        save_cache(invalid_tags_cache)
+    final_tags = list(dict.fromkeys(result_tags))
 
     # Формируем итоговую строку тегов
     final_tags_str = "; ".join(final_tags)
-    print(f"Итоговые теги: {final_tags_str}")
+    logger.debug("Итоговые теги: %s", final_tags_str)
     return final_tags_str
 
+# Исходный код специализированной функции; таблица тегов подставляется в виде литерала
+_NORMALIZER_TEMPLATE = """
+_LOOKUP = {lookup}
+
+def normalize_tags(tags: str, delayed_clean: bool = False) -> str:
+    if not delayed_clean:
+        result_tags = []
+        for tag in tags.split(";"):
+            allowed_name = _LOOKUP.get(normalize_tag(tag.strip()))
+            if allowed_name is None:
+                break
+            result_tags.append(allowed_name)
+        else:
+            # Кэш обслуживается так же, как в apply_tag_rules: устаревшие записи удаляются
+            invalid_tags_cache = load_cache()
+            if clean_cache(invalid_tags_cache):
+                save_cache(invalid_tags_cache)
+            return "; ".join(dict.fromkeys(result_tags))
+    return apply_tag_rules(tags, _COMPILED, delayed_clean)
+"""
+
+class TagNormalizer(Protocol):
+    """Функция обработки тегов, созданная make_tag_normalizer."""
+
+    def __call__(self, tags: str, delayed_clean: bool = False) -> str:
+        ...
+
+def make_tag_normalizer(rules: tuple[AllowedTagRecord, ...]) -> TagNormalizer:
+    """Создаёт функцию обработки тегов, специализированную под конкретную таблицу правил.
+
+    Таблица нормализованных тегов и синонимов встраивается в сгенерированный код
+    в виде литерала. Если все теги строки находятся точным поиском и отложенное
+    удаление выключено, результат формируется без разбиения и поиска лучшего
+    совпадения; иначе вызывается apply_tag_rules с заранее подготовленными
+    правилами. В обоих случаях кэш недействительных тегов очищается от
+    устаревших записей, как в apply_tag_rules.
+
+    Аргументы:
+        rules (tuple[AllowedTagRecord, ...]): Кортеж правил.
+
+    Возвращает:
+        TagNormalizer: Функция с параметрами tags и необязательным delayed_clean
+            (по умолчанию False), возвращающая тот же результат и оказывающая то же
+            действие на кэш, что и apply_tag_rules для заданных правил.
+    """
+    compiled = compile_rules(rules)
+    source = _NORMALIZER_TEMPLATE.format(lookup=repr(dict(compiled.allowed_tags_with_synonyms)))
+    namespace = {
+        "normalize_tag": normalize_tag,
+        "apply_tag_rules": apply_tag_rules,
+        "load_cache": load_cache,
+        "clean_cache": clean_cache,
+        "save_cache": save_cache,
+        "_COMPILED": compiled,
+    }
+    exec(compile(source, "<tag_normalizer>", "exec"), namespace)
+    return namespace["normalize_tags"]
+
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG, format="%(message)s")
     rules = (
         AllowedTagRecord("SRS", immutable=True),
         AllowedTagRecord("web_engine"),
@@ -131,6 +326,7 @@ if __name__ == "__main__":
         AllowedTagRecord("AUTO", immutable=True),
         AllowedTagRecord("lock_screen", "экран блокировки"),
     )
+    normalizer = make_tag_normalizer(rules)
 
     for input_tags, expected_tags in (
         ("WebEngine; AUTO", "web_engine; AUTO"),
@@ -141,6 +337,24 @@ if __name__ == "__main__":
         ("", ""),
         ("unknown-tag; lcd", "display"),
         ("auto", "AUTO"),
+        # составной тег: разрешённые части выделяются по заглавным буквам
+        ("ContactsLockScreen", "contacts"),
+        ("MessagesWebEngine", "sms"),
     ):
         RESULT = apply_tag_rules(input_tags, rules, delayed_clean=True)
         assert RESULT == expected_tags, f"Failed on {input_tags}: expected '{expected_tags}', got '{RESULT}'"
+        RESULT = normalizer(input_tags)
+        assert RESULT == expected_tags, f"Failed on {input_tags}: expected '{expected_tags}', got '{RESULT}'"
+
+    if ahocorasick is not None:
+        for input_tags, expected_tags in (
+            # составной тег без заглавных букв разделяется автоматом
+            ("lcdsvc", "display; svc"),
+            ("дисплейsvc", "display; svc"),
+            # разрешённый тег покрывает половину тега
+            ("x86_64", "x86"),
+            # случайное вхождение sms покрывает меньше половины тега, тег удаляется
+            ("gsmsignal", ""),
+        ):
+            RESULT = apply_tag_rules(input_tags, rules)
+            assert RESULT == expected_tags, f"Failed on {input_tags}: expected '{expected_tags}', got '{RESULT}'"